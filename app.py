@@ -3,20 +3,33 @@ import plotly.express as px
 import streamlit as st
 from datetime import datetime
 import subprocess
+import threading
+import queue
+import time
 import os
+import logging
+import tempfile
 from pathlib import Path
 import toml
+import xlsxwriter
 
 # --- 1. CONFIGURATION & SECRETS ---
 st.set_page_config(layout="wide", page_title="SoF Vehicle Assignments", page_icon="📊")
+# Copy-on-Write is always on from pandas 3; opt in on 2.x so shallow copies of cached frames stay safe
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+SECRETS_PATH = Path("secrets.toml")
+
+@st.cache_data(show_spinner=False)
+def read_secrets_file(mtime):
+    """Parsed once per process; a new mtime on secrets.toml forces a re-read"""
+    return toml.load(SECRETS_PATH)
 
 def load_secrets():
-    secrets_path = Path("secrets.toml")
-    if secrets_path.exists():
-        secrets = toml.load(secrets_path)
-        return secrets["git"]["repo"], secrets["git"]["branch"], secrets["auth"]["passcode"], secrets["git"]["deploy_key"]
-    else:
-        return st.secrets["git"]["repo"], st.secrets["git"]["branch"], st.secrets["auth"]["passcode"], st.secrets["git"]["deploy_key"]
+    # st.secrets is already cached by Streamlit and reloads on edit, so only the local file is memoized
+    secrets = read_secrets_file(SECRETS_PATH.stat().st_mtime_ns) if SECRETS_PATH.exists() else st.secrets
+    return secrets["git"]["repo"], secrets["git"]["branch"], secrets["auth"]["passcode"], secrets["git"]["deploy_key"]
 
 try:
     GITHUB_REPO, GITHUB_BRANCH, VEM_PASSCODE, DEPLOY_KEY = load_secrets()
@@ -25,118 +38,239 @@ except Exception as e:
     st.stop()
 
 FILE_PATH = "Vehicle_Checkout_List.xlsx"
+CACHE_PATH = "Vehicle_Checkout_List.parquet"
 GIT_SSH_URL = f"git@github.com:{GITHUB_REPO}.git"
+COLOR_PALETTE = px.colors.qualitative.Plotly
+PUSH_DEBOUNCE_SECONDS = 5
+END_OF_DAY = pd.Timedelta(hours=23, minutes=59)
 
 # --- 2. SSH & GIT SETUP ---
-def setup_git_ssh():
-    subprocess.run(["git", "config", "--global", "user.name", "Jacob Shelly"], check=False)
-    subprocess.run(["git", "config", "--global", "user.email", "jcs595@nau.edu"], check=False)
-    
+# One shell for the whole add/commit/push; exit codes 10-12 tell the caller which step stopped
+GIT_PUSH_SCRIPT = """
+git add -A && git diff --cached --quiet && exit 10
+git -c user.name="Jacob Shelly" -c user.email="jcs595@nau.edu" commit -m "$1" || exit 11
+git push -f "$2" "HEAD:$3" || exit 12
+"""
+
+def write_private_file(path, text):
+    # Created as 0600 up front, so the key is never briefly world-readable; fchmod covers a pre-existing looser file
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+def setup_git_ssh(deploy_key):
     ssh_dir = Path("~/.ssh").expanduser()
-    ssh_dir.mkdir(parents=True, exist_ok=True)
+    ssh_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
     
     key_file = ssh_dir / "github_deploy_key"
-    key_file.write_text(DEPLOY_KEY)
-    os.chmod(key_file, 0o600)
+    write_private_file(key_file, deploy_key)
     
     config_file = ssh_dir / "config"
-    config_file.write_text(f"Host github.com\n  HostName github.com\n  User git\n  IdentityFile {key_file}\n  StrictHostKeyChecking no\n")
-    os.chmod(config_file, 0o600)
+    # ControlMaster keeps the SSH session open so back-to-back pushes skip the handshake
+    write_private_file(config_file, f"Host github.com\n  HostName github.com\n  User git\n  IdentityFile {key_file}\n  StrictHostKeyChecking no\n"
+                                    f"  ControlMaster auto\n  ControlPath {ssh_dir}/cm-%r@%h:%p\n  ControlPersist 10m\n")
+    # A master left over from a previous key would keep authenticating with it; close it so the next push reconnects
+    subprocess.run(["ssh", "-O", "exit", "github.com"], capture_output=True)
 
-def push_changes_to_github(commit_message="Update vehicle data via Streamlit"):
-    """Returns True if successful, False if failed"""
+def push_changes_to_github(commit_message, ssh_url, branch):
+    """Returns (success, message), with success None when there was nothing to push. Runs on the push worker thread, so it must not call st.*"""
     try:
-        setup_git_ssh()
-        subprocess.run(["git", "add", "-A"], capture_output=True, text=True)
-        status = subprocess.run(["git", "status", "--porcelain"], capture_output=True, text=True)
+        res = subprocess.run(["sh", "-c", GIT_PUSH_SCRIPT, "sh", commit_message, ssh_url, branch],
+                             capture_output=True, text=True)
+        returncode, stderr = res.returncode, res.stderr
+        # If only the push failed the commit already exists; retry just the push
+        for _ in range(2):
+            if returncode != 12: break
+            time.sleep(2)
+            res = subprocess.run(["git", "push", "-f", ssh_url, f"HEAD:{branch}"], capture_output=True, text=True)
+            if res.returncode == 0: returncode = 0
+            stderr = res.stderr
         
-        if status.stdout.strip():
-            commit_res = subprocess.run(["git", "commit", "-m", commit_message], capture_output=True, text=True)
-            if commit_res.returncode != 0:
-                st.error(f"Commit Failed: {commit_res.stderr}")
-                return False
-
-            push_res = subprocess.run(["git", "push", "-f", GIT_SSH_URL, f"HEAD:{GITHUB_BRANCH}"], capture_output=True, text=True)
-            if push_res.returncode != 0:
-                st.error(f"Push Failed! GitHub says:\n{push_res.stderr}")
-                return False
-            else:
-                st.success("Successfully pushed changes to GitHub!")
-                return True
+        if returncode == 10:
+            return None, "No changes detected to push. (The Excel file might not have saved correctly)."
+        elif returncode == 11:
+            return False, f"Commit Failed: {stderr}"
+        elif returncode != 0:
+            return False, f"Push Failed! GitHub says:\n{stderr}"
         else:
-            st.info("No changes detected to push. (The Excel file might not have saved correctly).")
-            return True
+            return True, "Successfully pushed changes to GitHub!"
             
     except Exception as e:
-        st.error(f"System Error during push: {e}")
-        return False
+        return False, f"System Error during push: {e}"
+
+@st.cache_resource
+def get_push_worker():
+    """One background pusher per server process, so saving never waits on the network"""
+    worker = {"queue": queue.Queue(), "status": None}
+    def run():
+        written_key = None
+        while True:
+            jobs = [worker["queue"].get()]
+            # Give a burst of saves a moment to land so they go out as one commit
+            time.sleep(PUSH_DEBOUNCE_SECONDS)
+            while not worker["queue"].empty():
+                jobs.append(worker["queue"].get_nowait())
+            # Jobs carry the secrets of the run that queued them; the newest wins, so rotated repo/branch/key apply
+            _, ssh_url, branch, deploy_key = jobs[-1]
+            try:
+                if deploy_key != written_key:
+                    setup_git_ssh(deploy_key)
+                    written_key = deploy_key
+                worker["status"] = push_changes_to_github("; ".join(job[0] for job in jobs), ssh_url, branch)
+            except Exception as e:
+                worker["status"] = (False, f"System Error during SSH setup: {e}")
+            for _ in jobs: worker["queue"].task_done()
+    threading.Thread(target=run, daemon=True).start()
+    return worker
+
+def queue_push(commit_message):
+    get_push_worker()["queue"].put((commit_message, GIT_SSH_URL, GITHUB_BRANCH, DEPLOY_KEY))
 
 # --- 3. DATA LOADING & HELPERS ---
+@st.cache_data(show_spinner=False)
+def read_list(path, mtime):
+    with open(path, "r") as f:
+        return list(dict.fromkeys(filter(None, map(str.strip, f.read().splitlines()))))
+
 def load_list(path, default_options=None):
     if default_options is None: default_options = []
     if not os.path.exists(path): return default_options
-    with open(path, "r") as f:
-        items = [line.strip() for line in f if line.strip()]
-        return items if items else default_options
+    items = read_list(path, os.path.getmtime(path))
+    return items if items else default_options
+
+def append_to_list(path, item):
+    """Appends one line to a list file, adding the separating newline only if the file lacks one"""
+    with open(path, "ab+") as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n": f.write(b"\n")
+        f.write(item.encode("utf-8"))
 
 def set_time_to_2359(dt):
     if pd.isnull(dt): return pd.NaT
-    return pd.to_datetime(dt).replace(hour=23, minute=59, second=0)
+    return pd.Timestamp(dt).normalize() + END_OF_DAY
+
+def vehicle_number(type_name):
+    """The prefix before the first "-" in a type name: a number when it parses, otherwise the text itself"""
+    if "-" not in type_name:
+        return 0
+    prefix = type_name.split("-", 1)[0].strip()
+    # Numeric like the sheet's column where possible, but never swap a real prefix for NaN
+    number = pd.to_numeric(prefix, errors="coerce")
+    return prefix if pd.isna(number) else number
+
+def save_data(df):
+    """Writes df (minus Unique ID and blank rows) to the Excel file through xlsxwriter's constant-memory mode"""
+    df = df.drop(columns=["Unique ID"], errors='ignore').dropna(how="all")
+    # Write beside the sheet and swap it in, so an interrupted save can't leave a truncated workbook
+    # Each save gets its own temp name, so concurrent sessions never write into the same file
+    tmp_path = temp_path_beside(FILE_PATH, ".xlsx")
+    try:
+        wb = xlsxwriter.Workbook(tmp_path, {"constant_memory": True, "strings_to_urls": False, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+        ws = wb.add_worksheet("Sheet1")
+        ws.write_row(0, 0, list(df.columns))
+        for i, row in enumerate(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None), start=1):
+            ws.write_row(i, 0, row)
+        wb.close()
+        os.replace(tmp_path, FILE_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    # The frame is already in memory, so refresh the Parquet copy rather than re-parsing the xlsx on the next run
+    write_cache(tidy_frame(df))
+
+def tidy_frame(df):
+    """Gives a parsed sheet and a just-saved frame the same shape, so the Parquet copy reads back like the xlsx"""
+    # Empty cells come back from the xlsx as NaN, and calamine yields microsecond datetimes
+    df = df.reset_index(drop=True).replace("", float("nan"))
+    df['Checkout Date'] = pd.to_datetime(df['Checkout Date']).astype("datetime64[us]")
+    df['Return Date'] = (pd.to_datetime(df['Return Date']).dt.normalize() + END_OF_DAY).astype("datetime64[us]")
+    df['Unique ID'] = df.index
+    return df
+
+def temp_path_beside(path, suffix):
+    """A fresh temp file in path's directory, so os.replace onto path stays a same-filesystem rename"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-", suffix=suffix)
+    os.close(fd)
+    return tmp_path
+
+def write_cache(df):
+    """Best-effort Parquet copy of the sheet; read_data falls back to the xlsx if it is missing, older or unreadable"""
+    tmp_path = temp_path_beside(CACHE_PATH, ".parquet")
+    try:
+        # Swapped in whole, so a killed save can't leave a truncated sidecar behind
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, CACHE_PATH)
+    except Exception as e:
+        os.unlink(tmp_path)
+        logging.warning("Parquet cache not refreshed, next load will re-read the xlsx: %s", e)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def read_data(path, mtime):
+    # A parsed Parquet copy of the sheet loads far faster than the xlsx on a cold start
+    if os.path.exists(CACHE_PATH) and os.stat(CACHE_PATH).st_mtime_ns >= mtime:
+        try:
+            return pd.read_parquet(CACHE_PATH)
+        except Exception as e:
+            logging.warning("Parquet cache unreadable, re-reading the xlsx: %s", e)
+    # calamine's Rust reader parses the sheet several times faster than openpyxl
+    df = tidy_frame(pd.read_excel(path, engine="calamine"))
+    write_cache(df)
+    return df
 
-@st.cache_data
 def load_data():
+    """Returns (df, data_version); the Excel file is only re-parsed when its mtime changes"""
     if not os.path.exists(FILE_PATH):
         df = pd.DataFrame(columns=["Unique ID", "Type", "Vehicle #", "Assigned to", "Status", "Checkout Date", "Return Date", "Authorized Drivers", "Notes"])
-        df.to_excel(FILE_PATH, index=False, engine="openpyxl")
-    df = pd.read_excel(FILE_PATH, engine="openpyxl")
-    df['Checkout Date'] = pd.to_datetime(df['Checkout Date'])
-    df['Return Date'] = pd.to_datetime(df['Return Date']).apply(set_time_to_2359)
-    df['Unique ID'] = df.index
-    return df
+        save_data(df)
+    data_version = os.stat(FILE_PATH).st_mtime_ns
+    return read_data(FILE_PATH, data_version).copy(deep=False), data_version
 
-# --- 4. MAIN UI & GANTT CHART ---
-st.title("SoF Vehicle Assignments")
-df = load_data()
+@st.cache_resource
+def get_color_map():
+    """Assignee -> colour for the life of the server, so colours don't shift as bookings change"""
+    return {}
 
-view_col1, view_col2 = st.columns(2)
-with view_col1:
-    view_mode = st.selectbox("View Mode", ["Desktop", "Mobile"])
-with view_col2:
-    show_legend = st.checkbox("Show Legend", value=False)
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_gantt_chart(_df, data_version, type_order, today, show_legend):
+    """Returns the Gantt figure, or None if no booking falls inside the chart's history window"""
+    window_start = today - pd.Timedelta(days=30)
+    window_end = today + pd.Timedelta(days=30)
 
-today = datetime.today().replace(hour=0, minute=0, second=0)
+    # Old bookings are never on screen; keep them out of the chart payload
+    history_start = today - pd.Timedelta(days=90)
+    chart_df = _df[_df['Return Date'] >= history_start]
+    if chart_df.empty: return None
 
-window_start = today - pd.Timedelta(days=30)
-window_end = today + pd.Timedelta(days=30)
+    color_map = get_color_map()
+    for name in chart_df['Assigned to'].dropna().unique():
+        if name not in color_map: color_map[name] = COLOR_PALETTE[len(color_map) % len(COLOR_PALETTE)]
 
-if not df.empty:
     fig = px.timeline(
-        df, x_start="Checkout Date", x_end="Return Date", y="Type", 
-        color="Assigned to", text="Assigned to",
+        chart_df, x_start="Checkout Date", x_end="Return Date", y="Type", 
+        color="Assigned to", text="Assigned to", color_discrete_map=color_map,
         hover_data=["Status", "Notes", "Authorized Drivers"],
-        category_orders={"Type": load_list("type_list.txt")}
+        # Types missing from type_list.txt go last, so every bar (and its Reserved band) has an axis slot
+        category_orders={"Type": list(type_order) + [t for t in chart_df['Type'].dropna().unique() if t not in type_order]}
     )
 
-    unique_types = df['Type'].unique().tolist()
-    for _, row in df.iterrows():
-        if row['Status'] == 'Reserved':
-            try:
-                y_val = unique_types.index(row['Type'])
-                fig.add_shape(type="rect", x0=row['Checkout Date'], x1=row['Return Date'],
-                              y0=y_val-0.4, y1=y_val+0.4, fillcolor="rgba(255,0,0,0.1)", 
-                              line=dict(width=0), layer="below")
-            except: pass
-
-    min_date = df['Checkout Date'].min() - pd.Timedelta(days=30)
-    max_date = df['Return Date'].max() + pd.Timedelta(days=90)
-    
-    tick_vals = []
-    tick_text = []
+    # Shade reserved bookings; y positions follow the axis order px.timeline settled on
+    y_positions = {t: i for i, t in enumerate(fig.layout.yaxis.categoryarray or chart_df['Type'].unique())}
+    reserved = chart_df[chart_df['Status'] == 'Reserved']
+    fig.update_layout(shapes=[
+        dict(type="rect", x0=start, x1=end, y0=y_positions[t]-0.4, y1=y_positions[t]+0.4,
+             fillcolor="rgba(255,0,0,0.1)", line=dict(width=0), layer="below")
+        for start, end, t in zip(reserved['Checkout Date'], reserved['Return Date'], reserved['Type'])
+        if t in y_positions
+    ])
+
+    min_date = chart_df['Checkout Date'].min() - pd.Timedelta(days=30)
+    max_date = chart_df['Return Date'].max() + pd.Timedelta(days=90)
     
-    for d in pd.date_range(start=min_date, end=max_date):
-        if d.day in [1, 5, 10, 15, 20, 25]:
-            tick_vals.append(d)
-            tick_text.append(d.strftime("%b %-d") if d.day == 1 else str(d.day))
+    days = pd.date_range(start=min_date, end=max_date)
+    tick_vals = days[days.day.isin([1, 5, 10, 15, 20, 25])]
+    tick_text = tick_vals.strftime("%b %-d").where(tick_vals.day == 1, tick_vals.day.astype(str)).tolist()
 
     fig.update_layout(
         height=800, 
@@ -157,17 +291,42 @@ if not df.empty:
     )
     
     fig.add_vline(x=today, line_width=2, line_dash="dash", line_color="red")
-    
+    return fig
+
+# --- 4. MAIN UI & GANTT CHART ---
+st.title("SoF Vehicle Assignments")
+df, data_version = load_data()
+
+view_col1, view_col2 = st.columns(2)
+with view_col1:
+    view_mode = st.selectbox("View Mode", ["Desktop", "Mobile"])
+with view_col2:
+    show_legend = st.checkbox("Show Legend", value=False)
+
+today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+type_order = load_list("type_list.txt")
+fig = build_gantt_chart(df, data_version, tuple(type_order), today, show_legend)
+if fig is not None:
     st.plotly_chart(fig, use_container_width=True, config={'scrollZoom': True})
-else:
+elif df.empty:
     st.info("No vehicle data found. Please add an entry below.")
+else:
+    st.info("No bookings returned in the last 90 days or coming up, so there is nothing to chart.")
 
 # --- 5. MANAGEMENT CONSOLE ---
 with st.expander("🔧 VEM Management Console"):
     passcode = st.text_input("Enter Passcode", type="password")
     if passcode == VEM_PASSCODE:
+        push_worker = get_push_worker()
+        if push_worker["queue"].unfinished_tasks:
+            st.info("⏳ Pushing changes to GitHub...")
+        elif push_worker["status"]:
+            push_ok, push_message = push_worker["status"]
+            {True: st.success, False: st.error, None: st.info}[push_ok](push_message)
         
-        type_list = load_list("type_list.txt", ["Example Truck 1"])
+        type_list = type_order or ["Example Truck 1"]
+        vehicle_numbers = {t: vehicle_number(t) for t in type_list}
         assigned_list = load_list("assigned_to_list.txt", ["Example Crew A"])
         driver_list = load_list("authorized_drivers_list.txt", ["Example Driver 1"])
         
@@ -187,20 +346,17 @@ with st.expander("🔧 VEM Management Console"):
                 n_notes = st.text_area("Notes")
                 
                 if st.form_submit_button("Add Assignment"):
-                    new_row = pd.DataFrame([{
+                    # df is our own copy, so append in place instead of concat-copying every row
+                    df.loc[len(df)] = {
                         "Type": n_type, "Assigned to": n_assign, "Status": n_status,
                         "Checkout Date": pd.to_datetime(n_check), "Return Date": set_time_to_2359(n_ret),
                         "Authorized Drivers": ", ".join(n_drivers), "Notes": n_notes,
-                        "Vehicle #": n_type.split("-")[0] if "-" in n_type else "0"
-                    }])
-                    updated_df = pd.concat([df, new_row], ignore_index=True)
-                    updated_df.drop(columns=["Unique ID"], errors='ignore').to_excel(FILE_PATH, index=False, engine="openpyxl")
+                        "Vehicle #": vehicle_numbers[n_type], "Unique ID": len(df)
+                    }
+                    save_data(df)
                     
-                    # ONLY RERUN IF PUSH SUCCESSFUL
-                    success = push_changes_to_github(f"Added entry for {n_assign}")
-                    if success:
-                        st.cache_data.clear()
-                        st.rerun()
+                    queue_push(f"Added entry for {n_assign}")
+                    st.rerun()
 
         with tabs[1]: 
             st.info("💡 Double-click a cell to edit. Use the '+' at the bottom to add new rows quickly.")
@@ -208,6 +364,7 @@ with st.expander("🔧 VEM Management Console"):
                 df, 
                 num_rows="dynamic", 
                 key="main_editor",
+                disabled=["Unique ID"],
                 column_config={
                     "Type": st.column_config.SelectboxColumn("Type", options=type_list, required=True),
                     "Assigned to": st.column_config.SelectboxColumn("Assigned to", options=assigned_list, required=True),
@@ -217,11 +374,10 @@ with st.expander("🔧 VEM Management Console"):
                 }
             )
             if st.button("Save Table Changes"):
-                edited_df.drop(columns=["Unique ID"], errors='ignore').to_excel(FILE_PATH, index=False, engine="openpyxl")
-                success = push_changes_to_github("Updated data via interactive editor")
-                if success:
-                    st.cache_data.clear()
-                    st.rerun()
+                edited_df['Return Date'] = pd.to_datetime(edited_df['Return Date']).dt.normalize() + END_OF_DAY
+                save_data(edited_df)
+                queue_push("Updated data via interactive editor")
+                st.rerun()
 
         with tabs[2]: 
             st.subheader("Delete Range")
@@ -233,24 +389,23 @@ with st.expander("🔧 VEM Management Console"):
             st.dataframe(to_delete)
             if st.button("Confirm Bulk Delete"):
                 df = df[~mask]
-                df.drop(columns=["Unique ID"], errors='ignore').to_excel(FILE_PATH, index=False, engine="openpyxl")
-                success = push_changes_to_github("Bulk deletion performed")
-                if success:
-                    st.cache_data.clear()
-                    st.rerun()
+                save_data(df)
+                queue_push("Bulk deletion performed")
+                st.rerun()
 
         with tabs[3]: 
             list_choice = st.selectbox("Select List", ["Names", "Vehicles", "Drivers"])
             paths = {"Names": "assigned_to_list.txt", "Vehicles": "type_list.txt", "Drivers": "authorized_drivers_list.txt"}
             
-            current_items = load_list(paths[list_choice], ["(List is empty)"])
-            st.write(f"**Current items in {list_choice}:** {', '.join(current_items)}")
+            current_items = load_list(paths[list_choice])
+            st.write(f"**Current items in {list_choice}:** {', '.join(current_items) or '(List is empty)'}")
             
-            new_item = st.text_input(f"Add new {list_choice}")
+            new_item = st.text_input(f"Add new {list_choice}").strip()
             if st.button("Add to List"):
-                with open(paths[list_choice], "a") as f:
-                    f.write(f"\n{new_item}")
-                success = push_changes_to_github(f"Added {new_item} to {list_choice} list")
-                if success:
-                    st.cache_data.clear()
+                # Nothing to write or push for a blank or already-listed entry
+                if not new_item or new_item.lower() in {item.lower() for item in current_items}:
+                    st.warning(f"'{new_item}' is already in the {list_choice} list." if new_item else "Enter a name first.")
+                else:
+                    append_to_list(paths[list_choice], new_item)
+                    queue_push(f"Added {new_item} to {list_choice} list")
                     st.rerun()